@@ -13,16 +13,66 @@
 # limitations under the License.
 # ==============================================================================
 
-import base64
 import pickle
 import cloudpickle
 
+try:
+    # pybase64 provides SIMD-accelerated drop-in replacements for base64 functions
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+
+def encode_base64(data):
+    return base64.b64encode(data)
+
+
+def decode_base64(encoded):
+    return base64.b64decode(encoded, validate=True)
+
 
 def loads_base64(encoded):
     decoded = base64.b64decode(encoded)
     return cloudpickle.loads(decoded)
 
 
+def loads_base64_from_stream(stream, length, chunk_size=48 * 1024):
+    """
+    Reads length bytes of base64 encoded data from the given binary stream and
+    decodes them in chunks, so that the encoded data is never held in memory as a whole.
+
+    :param stream: binary stream that supports readinto
+    :param length: number of encoded bytes to read from the stream
+    :param chunk_size: number of encoded bytes to decode at once, rounded down to a multiple of 4
+    :return: the unpickled object
+    """
+    # base64 encodes 3 bytes into 4 characters, chunks of a multiple of 4 decode independently
+    chunk_size = max(chunk_size - chunk_size % 4, 4)
+    chunk = memoryview(bytearray(min(chunk_size, length)))
+    decoded = bytearray(length // 4 * 3)
+
+    offset = 0
+    remaining = length
+    while remaining:
+        size = min(chunk_size, remaining)
+        filled = 0
+        while filled < size:
+            read = stream.readinto(chunk[filled:size])
+            if not read:
+                raise EOFError('Stream ended after {} of {} bytes'
+                               .format(length - remaining + filled, length))
+            filled += read
+        remaining -= size
+
+        data = base64.b64decode(chunk[:size])
+        decoded[offset:offset + len(data)] = data
+        offset += len(data)
+
+    # the padding of the last chunk decodes into fewer bytes
+    del decoded[offset:]
+    return cloudpickle.loads(decoded)
+
+
 def dumps_base64(obj, to_ascii=True):
     serialized = cloudpickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
     encoded = base64.b64encode(serialized)
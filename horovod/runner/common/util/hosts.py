@@ -18,6 +18,9 @@ import re
 
 from dataclasses import dataclass
 
+# <IP address> or <host name>:<number of slots>
+_HOST_SLOTS_PATTERN = re.compile(r'^([\w.-]+):([0-9]+)$')
+
 
 class HostInfo:
     def __init__(self, hostname, slots):
@@ -58,13 +61,21 @@ def parse_host_files(filename):
     :param filename: Should be in <IP address> or <host name> slots=<number of GPUs>
     :return: Comma separated string of <IP address> or <host name>:<Number of GPUs>
     """
-    hosts = []
     with open(filename, 'r') as f:
-        for line in f.readlines():
-            line = line.rstrip()
-            hostname = line.split()[0]
-            slots = line.split('=')[1]
-            hosts.append('{name}:{slots}'.format(name=hostname, slots=slots))
+        text = f.read()
+
+    hosts = []
+    for line in text.splitlines():
+        parts = line.split(None, 1)
+        if not parts:
+            # skip blank lines
+            continue
+        hostname = parts[0]
+        slots = parts[1].partition('=')[2].strip() if len(parts) > 1 else ''
+        if not slots:
+            raise ValueError('Invalid hostfile line, please make sure it has '
+                             'format as : worker-0 slots=2. Line: {}'.format(line))
+        hosts.append(f'{hostname}:{slots}')
     return ','.join(hosts)
 
 
@@ -73,12 +84,12 @@ def parse_hosts_and_slots(hosts):
     host_to_slots = {}
 
     host_list = hosts.split(',')
-    pattern = re.compile(r'^[\w.-]+:[0-9]+$')
     for host in host_list:
-        if not pattern.match(host.strip()):
+        match = _HOST_SLOTS_PATTERN.match(host.strip())
+        if not match:
             raise ValueError('Invalid host input, please make sure it has '
                              'format as : worker-0:2,worker-1:2.')
-        hostname, slots = host.strip().split(':')
+        hostname, slots = match.groups()
         host_names.append(hostname)
         host_to_slots[hostname] = int(slots)
     return host_names, host_to_slots
@@ -22,15 +22,33 @@ import subprocess
 import sys
 import threading
 import time
+import traceback
 
 import psutil
 
-from horovod.runner.util.threads import in_thread, on_event
+from horovod.runner.util.threads import in_thread, on_any_event, on_event
 
 GRACEFUL_TERMINATION_TIME_S = 5
 
+# Environment variable that sets the multiprocessing start method of the middleman process.
+# 'spawn' is safe to use from multi-threaded processes like the launcher, 'fork' starts
+# the middleman faster but may deadlock if other threads hold locks while forking,
+# and the middleman inherits all file descriptors that are open in this process.
+# 'forkserver' starts one long-lived server process that has this module preloaded and forks
+# all middleman processes, which is safe and amortizes the startup across execute calls.
+HOROVOD_MP_CONTEXT = 'HOROVOD_MP_CONTEXT'
+DEFAULT_MP_CONTEXT = 'spawn'
+
+# Number of bytes read from the command's stdout and stderr pipes at most at once
+READ_BUFFER_SIZE = 1 << 16
+
+# A complete line of output, terminated by \n or \r
+_LINE_PATTERN = re.compile('[^\r\n]*[\r\n]')
+
 
 def terminate_executor_shell_and_children(pid):
+    # The executor is either the shell running the command or the command itself,
+    # in the latter case there is one level less of children to terminate.
     # If the shell already ends, no need to terminate its child.
     try:
         p = psutil.Process(pid)
@@ -38,14 +56,15 @@ def terminate_executor_shell_and_children(pid):
         return
 
     # Terminate children gracefully.
-    for child in p.children():
+    children = p.children()
+    for child in children:
         try:
             child.terminate()
         except psutil.NoSuchProcess:
             pass
 
     # Wait for graceful termination.
-    gone, alive = psutil.wait_procs(p.children(), timeout=GRACEFUL_TERMINATION_TIME_S)
+    gone, alive = psutil.wait_procs(children, timeout=GRACEFUL_TERMINATION_TIME_S)
 
     # Freeze the process to prevent it from spawning any new children.
     try:
@@ -53,17 +72,17 @@ def terminate_executor_shell_and_children(pid):
     except psutil.NoSuchProcess:
         pass
 
-    # Kill children recursively.
-    for child in alive:
+    # Kill children recursively, all descendants are listed with a single scan of the process table.
+    if alive:
         try:
-            for grandchild in child.children(recursive=True):
-                try:
-                    grandchild.kill()
-                except psutil.NoSuchProcess:
-                    pass
-            child.kill()
+            descendants = p.children(recursive=True)
         except psutil.NoSuchProcess:
-            pass
+            descendants = alive
+        for descendant in descendants:
+            try:
+                descendant.kill()
+            except psutil.NoSuchProcess:
+                pass
 
     # Kill shell itself.
     try:
@@ -80,12 +99,108 @@ def terminate_executor_shell_and_children(pid):
             pass
 
 
+class _PrefixedStream(object):
+    """
+    Writes utf8 bytes to the given text stream, prefixing each line with timestamp,
+    prefix and index in this format, if index and prefix are not None:
+        {time}[{index}]<{prefix}>:{line}
+    Lines are only written once complete, an empty write flushes any incomplete line.
+    All lines of one write are written to the text stream at once, which is only
+    flushed on flush().
+    """
+    def __init__(self, dst_stream, prefix, index, prefix_output_with_timestamp):
+        self._dst_stream = dst_stream
+        self._prefix_output_with_timestamp = prefix_output_with_timestamp
+        self._prefixed = index is not None and prefix is not None
+        # only the timestamp part of the context changes
+        self._context = '[{rank}]<{prefix}>:'.format(rank=str(index), prefix=prefix)
+        self._unflushed = False
+
+        # the incremental encoder allows us to decode chunks of utf8 bytes
+        # with utf8 characters spread across the boundary chunks
+        self._decoder = codecs.getincrementaldecoder('utf8')()
+        # fragments of the incomplete last line, joined once the line is complete,
+        # so long lines spread over many reads are not copied with every read
+        self._line_buffer = []
+
+        # timestamps have a resolution of seconds, so they are only formatted once per second
+        self._timestamp = ''
+        self._timestamp_seconds = None
+
+    def _get_timestamp(self):
+        seconds = int(time.time())
+        if seconds != self._timestamp_seconds:
+            self._timestamp = time.asctime(time.localtime(seconds))
+            self._timestamp_seconds = seconds
+        return self._timestamp
+
+    def _get_context(self):
+        if self._prefix_output_with_timestamp:
+            return self._get_timestamp() + self._context
+        return self._context
+
+    def _write(self, text):
+        self._dst_stream.write(text)
+        self._unflushed = True
+
+    def write(self, buf):
+        # turn the bytes into string decoding them as utf8
+        # we need to use an incremental decoder as characters can span multiple bytes
+        # where the last character might not be completely in buf
+        # see https://github.com/horovod/horovod/issues/2367
+        text = self._decoder.decode(buf, final=not buf)
+
+        if not self._prefixed:
+            # without prefix there is no need to split the text into lines
+            if text:
+                self._write(text)
+            return
+
+        # write lines out when we reach an \n or \r
+        # the latter is used to update the current line (e.g. progress bar)
+        # which we want to flush out (and prefix) as soon as possible
+        # only scan up to the last line end, scanning an incomplete line for a line end
+        # from every position would take quadratic time
+        end = max(text.rfind('\n'), text.rfind('\r')) + 1
+        lines = _LINE_PATTERN.findall(text, 0, end)
+        rest = text[end:]
+        if lines and self._line_buffer:
+            # the first line completes the line buffer
+            self._line_buffer.append(lines[0])
+            lines[0] = ''.join(self._line_buffer)
+            self._line_buffer = []
+
+        # keep the incomplete last line in the line buffer
+        if rest:
+            self._line_buffer.append(rest)
+
+        # write the line buffer on EOF if it is not empty
+        if not buf and self._line_buffer:
+            lines.append(''.join(self._line_buffer))
+            self._line_buffer = []
+
+        # all lines read at once share the same context
+        if lines:
+            context = self._get_context()
+            lines = [context + line for line in lines]
+
+        # coalesce all lines into a single write
+        if lines:
+            self._write(''.join(lines))
+
+    def flush(self):
+        if self._unflushed:
+            self._dst_stream.flush()
+            self._unflushed = False
+
+
 def prefix_connection(src_connection, dst_stream, prefix, index, prefix_output_with_timestamp):
     """
     Prefixes the given source connection with timestamp, a prefix and an index.
     Each line of the source will be prefix in this format, if index and prefix are not None:
         {time}[{index}]<{prefix}>:{line}
     The dst_stream must be text streams.
+    When writing to dst_stream fails, the remaining output of the source connection is discarded.
 
     :param src_connection: source pipe connection
     :param dst_stream: destination text stream
@@ -94,71 +209,57 @@ def prefix_connection(src_connection, dst_stream, prefix, index, prefix_output_w
     :param prefix_output_with_timestamp: prefix lines in dst_stream with timestamp
     :return: None
     """
-    def get_context(rank, prefix):
-        localtime = time.asctime(time.localtime(time.time())) if prefix_output_with_timestamp else ''
-        return '{time}[{rank}]<{prefix}>:'.format(
-            time=localtime,
-            rank=str(rank),
-            prefix=prefix
-        )
-
-    def write(text):
-        if index is not None and prefix is not None:
-            context = get_context(index, prefix)
-            text = context + text
-        dst_stream.write(text)
-        dst_stream.flush()
-
-    # the incremental encoder allows us to decode chunks of utf8 bytes
-    # with utf8 characters spread across the boundary chunks
-    decoder = codecs.getincrementaldecoder('utf8')()
-
-    line_buffer = ''
-    while True:
-        # read at most that many bytes, but do not wait until that many bytes become available
-        # waits for the first bytes so this is not a busy loop
-        buf = os.read(src_connection.fileno(), 1000)
-
-        # turn the bytes into string decoding them as utf8
-        # we need to use an incremental decoder as characters can span multiple bytes
-        # where the last character might not be completely in buf
-        # see https://github.com/horovod/horovod/issues/2367
-        text = decoder.decode(buf or b'', final=not buf)
-
-        # write line_buffer out when we reach an \n or \r
-        # the latter is used to update the current line (e.g. progress bar)
-        # which we want to flush out (and prefix) as soon as possible
-        for line in re.split('([\r\n])', text):
-            line_buffer += line
-            if line == '\r' or line == '\n':
-                write(line_buffer)
-                line_buffer = ''
-
-        # not an empty text indicates EOF but an empty buf
-        if not buf:
-            break
-
-    # flush the line buffer if it is not empty
-    if len(line_buffer):
-        write(line_buffer)
-
-    src_connection.close()
+    stream = _PrefixedStream(dst_stream, prefix, index, prefix_output_with_timestamp)
+    try:
+        while True:
+            # read at most that many bytes, but do not wait until that many bytes become available
+            # waits for the first bytes so this is not a busy loop
+            buf = os.read(src_connection.fileno(), READ_BUFFER_SIZE)
+            if stream is not None:
+                try:
+                    stream.write(buf)
+                    # flush only once the pipe is drained, a full read indicates more pending output
+                    if len(buf) < READ_BUFFER_SIZE:
+                        stream.flush()
+                except Exception:
+                    traceback.print_exc()
+                    # keep draining the connection so the command does not block on a full pipe
+                    stream = None
+            # an empty buf indicates EOF
+            if not buf:
+                break
+    finally:
+        src_connection.close()
 
 
-def _exec_middleman(command, env, exit_event, stdout, stderr, rw):
-    stdout_r, stdout_w = stdout
-    stderr_r, stderr_w = stderr
+def _exec_middleman(command, env, exit_event, stdout_w, stderr_w, rw, stdin=None, inherited_fds=None):
     r, w = rw
 
     # Close unused file descriptors to enforce PIPE behavior.
-    stdout_r.close()
-    stderr_r.close()
+    # The read ends of stdout and stderr are not handed to the middleman,
+    # only with the 'fork' start method they are inherited and have to be closed here.
+    for fd in inherited_fds or []:
+        os.close(fd)
     w.close()
     os.setsid()
 
-    executor_shell = subprocess.Popen(command, shell=True, env=env,
+    # a list of arguments is executed directly, without a shell process in between
+    executor_shell = subprocess.Popen(command, shell=not isinstance(command, (list, tuple)), env=env,
+                                      stdin=subprocess.PIPE if stdin is not None else None,
                                       stdout=stdout_w, stderr=stderr_w)
 
+    if stdin is not None:
+        def write_stdin():
+            # the command may exit without reading all of its stdin
+            try:
+                executor_shell.stdin.write(stdin)
+                executor_shell.stdin.close()
+            except BrokenPipeError:
+                pass
+
+        # writing in background as this blocks until the command consumed the input
+        in_thread(write_stdin)
+
     # we don't bother stopping the on_event thread, this process sys.exits soon
     # so the on_event thread has to be a daemon thread
     on_event(exit_event, terminate_executor_shell_and_children, args=(executor_shell.pid,), daemon=True)
@@ -179,6 +280,14 @@ def _exec_middleman(command, env, exit_event, stdout, stderr, rw):
     sys.exit(exit_code)
 
 
+def _get_mp_context():
+    ctx = multiprocessing.get_context(os.environ.get(HOROVOD_MP_CONTEXT, DEFAULT_MP_CONTEXT))
+    if ctx.get_start_method() == 'forkserver':
+        # only takes effect before the fork server has been started by the first execute call
+        ctx.set_forkserver_preload([__name__])
+    return ctx
+
+
 def _create_event(ctx):
     # We need to expose this method for internal testing purposes, so we can mock it out to avoid
     # leaking semaphores.
@@ -186,29 +295,36 @@ def _create_event(ctx):
 
 
 def execute(command, env=None, stdout=None, stderr=None, index=None, events=None,
-            prefix_output_with_timestamp=False):
+            prefix_output_with_timestamp=False, stdin=None):
     """
     Execute the given command and forward stdout and stderr of the command to the given
     stdout and stderr text streams, or sys.stdout and sys.stderr, respectively, if None given.
     Prefixes each line with index and timestamp if index is not None. The timestamp
     can be disabled with prefix_output_with_timestamp set False.
     The command will be terminated when any of the given events are set.
+    The command is executed by a middleman process, started with the multiprocessing
+    start method given by the HOROVOD_MP_CONTEXT environment variable ('spawn' by default).
 
-    :param command: command to execute
+    :param command: command to execute, either a string that is executed by a shell,
+                    or a list of arguments that is executed without a shell
     :param env: environment variables to execute command with
     :param stdout: stdout text stream, sys.stdout if None
     :param stderr: stderr text stream, sys.stderr if None
     :param index: index used to prepend text streams
     :param events: events to terminate the command
     :param prefix_output_with_timestamp: prepend text streams with timestamp if True
+    :param stdin: bytes written to the command's stdin, which is then closed,
+                  the command inherits stdin if None
     :return: command's exit code
     """
-    ctx = multiprocessing.get_context('spawn')
+    ctx = _get_mp_context()
 
     # When this event is set, signal to middleman to terminate its children and exit.
     exit_event = _create_event(ctx)
 
     # Make a pipe for the subprocess stdout/stderr.
+    # A simplex Pipe is a plain os.pipe, no data is framed or pickled, we only use the file descriptors.
+    # The Connection objects are needed to hand the write ends to the spawned middleman.
     (stdout_r, stdout_w) = ctx.Pipe(duplex=False)
     (stderr_r, stderr_w) = ctx.Pipe(duplex=False)
 
@@ -219,10 +335,12 @@ def execute(command, env=None, stdout=None, stderr=None, index=None, events=None
     # here is that users will be inclined to hard kill this process, not the middleman.
     (r, w) = ctx.Pipe(duplex=False)
 
+    # A forked middleman inherits the read ends, it must not keep them open.
+    inherited_fds = [stdout_r.fileno(), stderr_r.fileno()] if ctx.get_start_method() == 'fork' else None
+
     middleman = ctx.Process(target=_exec_middleman, args=(command, env, exit_event,
-                                                          (stdout_r, stdout_w),
-                                                          (stderr_r, stderr_w),
-                                                          (r, w)))
+                                                          stdout_w, stderr_w,
+                                                          (r, w), stdin, inherited_fds))
     middleman.start()
 
     # Close unused file descriptors to enforce PIPE behavior.
@@ -238,16 +356,19 @@ def execute(command, env=None, stdout=None, stderr=None, index=None, events=None
     if stderr is None:
         stderr = sys.stderr
 
-    stdout_fwd = in_thread(target=prefix_connection, args=(stdout_r, stdout, 'stdout', index, prefix_output_with_timestamp))
-    stderr_fwd = in_thread(target=prefix_connection, args=(stderr_r, stderr, 'stderr', index, prefix_output_with_timestamp))
+    # Each stream is forwarded by its own thread, so a destination that blocks (e.g. a streams.Pipe
+    # with a stalled consumer) does not hold back the output of the other stream.
+    stdout_fwd = in_thread(target=prefix_connection,
+                           args=(stdout_r, stdout, 'stdout', index, prefix_output_with_timestamp))
+    stderr_fwd = in_thread(target=prefix_connection,
+                           args=(stderr_r, stderr, 'stderr', index, prefix_output_with_timestamp))
 
     # TODO: Currently this requires explicitly declaration of the events and signal handler to set
     #  the event (gloo_run.py:_launch_jobs()). Need to figure out a generalized way to hide this behind
     #  interfaces.
     stop = threading.Event()
-    events = events or []
-    for event in events:
-        on_event(event, exit_event.set, stop=stop, silent=True)
+    if events:
+        on_any_event(events, exit_event.set, stop=stop, silent=True)
 
     try:
         middleman.join()
@@ -15,13 +15,17 @@
 
 import io
 import os
+import pickle
 import sys
 
+import cloudpickle
+
 from socket import AF_INET
 from psutil import net_if_addrs
 
 from horovod.runner.common.service import driver_service
 from horovod.runner.common.util import codec, safe_shell_exec
+from horovod.runner.common.util import env as env_util
 from horovod.runner.task import task_service
 from horovod.runner.util import cache, lsf, network, threads
 from horovod.runner.util.remote import get_remote_command
@@ -73,12 +77,13 @@ def _launch_task_servers(all_host_names, local_host_names, driver_addresses,
     :rtype:
     """
 
-    def _exec_command(command):
+    def _exec_command(command, stdin):
         host_output = io.StringIO()
         try:
             exit_code = safe_shell_exec.execute(command,
                                                 stdout=host_output,
-                                                stderr=host_output)
+                                                stderr=host_output,
+                                                stdin=stdin)
             if exit_code != 0:
                 print(
                     'Launching horovod task function was not '
@@ -91,25 +96,32 @@ def _launch_task_servers(all_host_names, local_host_names, driver_addresses,
 
     args_list = []
     num_hosts = len(all_host_names)
+    # only the index differs between hosts, so build all other parts of the command once
+    command_head = f'{sys.executable} -m horovod.runner.task_fn'
+    command_tail = f'{codec.dumps_base64(num_hosts)} ' \
+                   f'{codec.dumps_base64(driver_addresses)} ' \
+                   f'{codec.dumps_base64(settings)}'
+    # ssh forwards stdin to the remote command, which saves encoding the arguments
+    # into the command line, the Kubeflow exec script does not forward stdin
+    use_stdin = not env_util.is_kubeflow_mpi()
+    stdin = cloudpickle.dumps((num_hosts, driver_addresses, settings),
+                              protocol=pickle.HIGHEST_PROTOCOL) if use_stdin else None
     for index in range(num_hosts):
         host_name = all_host_names[index]
-        command = \
-            '{python} -m horovod.runner.task_fn {index} {num_hosts} ' \
-            '{driver_addresses} {settings}' \
-            .format(python=sys.executable,
-                    index=codec.dumps_base64(index),
-                    num_hosts=codec.dumps_base64(num_hosts),
-                    driver_addresses=codec.dumps_base64(driver_addresses),
-                    settings=codec.dumps_base64(settings))
-        if host_name not in local_host_names:
+        if host_name in local_host_names:
+            command = f'{command_head} {codec.dumps_base64(index)} {command_tail}'
+            args_list.append([command, None])
+        else:
+            command = f'{command_head} {codec.dumps_base64(index)}' if use_stdin \
+                else f'{command_head} {codec.dumps_base64(index)} {command_tail}'
             command = get_remote_command(command,
                                          host=host_name,
                                          port=settings.ssh_port,
                                          identity_file=settings.ssh_identity_file)
+            args_list.append([command, stdin])
 
         if settings.verbose >= 2:
             print('Launching horovod task function: {}'.format(command))
-        args_list.append([command])
     # Each thread will use ssh command to launch the server on one task. If an
     # error occurs in one thread, entire process will be terminated. Otherwise,
     # threads will keep running and ssh session -- and the the task server --
@@ -124,16 +136,21 @@ def _run_probe(driver, settings, num_hosts):
     if settings.verbose >= 2:
         print('Waiting for the hosts to acknowledge.')
     driver.wait_for_initial_registration(settings.start_timeout)
-    tasks = [
-        task_service.HorovodRunTaskClient(
+
+    def notify_initial_registration_complete(index):
+        # creating the client probes the task's addresses, so this happens concurrently as well
+        task = task_service.HorovodRunTaskClient(
             index,
             driver.task_addresses_for_driver(index),
             settings.key,
-            settings.verbose) for index in range(
-            num_hosts)]
-    # Notify all the drivers that the initial registration is complete.
-    for task in tasks:
+            settings.verbose)
         task.notify_initial_registration_complete()
+
+    # Notify all the drivers that the initial registration is complete.
+    # Notifications are independent network round-trips, so send them concurrently.
+    threads.execute_function_multithreaded(
+        notify_initial_registration_complete,
+        [[index] for index in range(num_hosts)])
     if settings.verbose >= 2:
         print('Notified all the hosts that the registration is complete.')
     # Each worker should probe the interfaces of the next worker in a ring
@@ -146,10 +163,8 @@ def _run_probe(driver, settings, num_hosts):
     if settings.verbose >= 2:
         print('Host-to-host interface checking successful.')
     # Determine a set of common interfaces for task-to-task communication.
-    nics = set(driver.task_addresses_for_tasks(0).keys())
-    for index in range(1, num_hosts):
-        nics.intersection_update(
-            driver.task_addresses_for_tasks(index).keys())
+    nics = set(driver.task_addresses_for_tasks(0).keys()).intersection(
+        *[driver.task_addresses_for_tasks(index).keys() for index in range(1, num_hosts)])
     if not nics:
         raise Exception(
             'Unable to find a set of common task-to-task communication interfaces: %s'
@@ -198,14 +213,9 @@ def get_local_interfaces(settings):
               'with address 127.0.0.1')
     # If all the given hosts are local, find the interfaces with address
     # 127.0.0.1
-    nics = set()
-    for iface, addrs in net_if_addrs().items():
-        if settings.nics and iface not in settings.nics:
-            continue
-        for addr in addrs:
-            if addr.family == AF_INET and addr.address == '127.0.0.1':
-                nics.add(iface)
-                break
+    nics = {iface for iface, addrs in net_if_addrs().items()
+            if (not settings.nics or iface in settings.nics) and
+            any(addr.family == AF_INET and addr.address == '127.0.0.1' for addr in addrs)}
 
     if len(nics) == 0:
         raise ValueError('No interface is found for address 127.0.0.1.')
@@ -249,7 +259,8 @@ def get_common_interfaces(settings, all_host_names, remote_host_names=None, fn_c
                 print('Testing interfaces on all the hosts.')
 
             local_host_names = set(all_host_names) - set(remote_host_names)
-            nics = _driver_fn(all_host_names, local_host_names, settings, fn_cache=fn_cache)
+            # hosts are sorted as their order is part of the cache key but does not affect the result
+            nics = _driver_fn(sorted(all_host_names), local_host_names, settings, fn_cache=fn_cache)
 
             if settings.verbose >= 2:
                 print('Interfaces on all the hosts were successfully checked.')
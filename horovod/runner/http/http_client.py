@@ -13,33 +13,143 @@
 # limitations under the License.
 # =============================================================================
 
-from urllib.request import urlopen
-from urllib.request import Request
-from urllib.error import HTTPError, URLError
+import http.client
+import json
+import pickle
+import threading
+
+import cloudpickle
 
 from horovod.runner.common.util import codec
+from horovod.runner.http.http_server import BATCH_KEY, BINARY_CONTENT_TYPE, BINARY_SUPPORT_HEADER
+
+# Timeout for establishing a connection to and reading from the KVStore server
+REQUEST_TIMEOUT = 30
+
+OK = 200
+
+# Persistent connections to KVStore servers, one per (addr, port) and thread.
+# http.client.HTTPConnection is not thread-safe, so connections cannot be shared across threads.
+_connections = threading.local()
+
+# Whether a KVStore server at (addr, port) accepts unencoded values, learned from its responses
+_binary_support = {}
+
+
+def _get_connection(addr, port):
+    if not hasattr(_connections, 'pool'):
+        _connections.pool = {}
+    conn = _connections.pool.get((addr, port))
+    if conn is None:
+        conn = http.client.HTTPConnection(addr, port, timeout=REQUEST_TIMEOUT)
+        _connections.pool[(addr, port)] = conn
+    return conn
+
+
+def _close_connection(addr, port):
+    conn = _connections.pool.pop((addr, port), None)
+    if conn is not None:
+        conn.close()
+
+
+def _request(addr, port, method, path, body=None, read=None, headers=None):
+    """
+    Sends a request to the KVStore server and returns the response body.
+    A successful response is passed to read if given, which has to consume the entire body.
+    Raises RuntimeError if the server does not respond with status OK.
+    """
+    headers = dict(headers or {}, Connection='keep-alive')
+    # the server may have closed an idle keep-alive connection in the meantime,
+    # so we retry exactly once on a fresh connection
+    for attempt in range(2):
+        conn = _get_connection(addr, port)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            if resp.status == OK and read is not None:
+                data = read(resp)
+            else:
+                data = resp.read()
+        except (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                ConnectionResetError, BrokenPipeError):
+            _close_connection(addr, port)
+            if attempt > 0:
+                raise
+            continue
+        except:
+            _close_connection(addr, port)
+            raise
+
+        _binary_support[(addr, port)] = resp.getheader(BINARY_SUPPORT_HEADER) is not None
+        if resp.will_close:
+            _close_connection(addr, port)
+        if resp.status != OK:
+            raise RuntimeError("KVStore server responded with status {status}."
+                               .format(status=resp.status))
+        return data
+
+
+def _read_value(resp):
+    if resp.getheader('Content-Type') == BINARY_CONTENT_TYPE:
+        return cloudpickle.loads(resp.read())
+    if resp.length is None:
+        return codec.loads_base64(resp.read())
+    # decode the body while reading it instead of buffering the entire encoded body
+    return codec.loads_base64_from_stream(resp, resp.length)
 
 
 def read_data_from_kvstore(addr, port, scope, key):
     try:
-        url = "http://{addr}:{port}/{scope}/{key}".format(
-            addr=addr, port=str(port), scope=scope, key=key
-        )
-        req = Request(url)
-        resp = urlopen(req)
-        # TODO: remove base64 encoding because base64 is not efficient
-        return codec.loads_base64(resp.read())
-    except (HTTPError, URLError) as e:
+        path = "/{scope}/{key}".format(scope=scope, key=key)
+        # servers that do not support binary values ignore the Accept header and send base64
+        return _request(addr, port, "GET", path, read=_read_value,
+                        headers={'Accept': BINARY_CONTENT_TYPE})
+    except (http.client.HTTPException, OSError, EOFError) as e:
+        # EOFError is raised when the body ends before its Content-Length
         raise RuntimeError("Read data from KVStore server failed.", e)
 
 
 def put_data_into_kvstore(addr, port, scope, key, value):
     try:
-        url = "http://{addr}:{port}/{scope}/{key}".format(
-            addr=addr, port=str(port), scope=scope, key=key
-        )
-        req = Request(url, data=codec.dumps_base64(value, to_ascii=False))
-        req.get_method = lambda: "PUT"  # for urllib2 compatibility
-        urlopen(req)
-    except (HTTPError, URLError) as e:
+        path = "/{scope}/{key}".format(scope=scope, key=key)
+        if _binary_support.get((addr, port)):
+            # send the pickled value as is, without holding a base64 encoded copy in memory
+            _request(addr, port, "PUT", path,
+                     body=cloudpickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+                     headers={'Content-Type': BINARY_CONTENT_TYPE})
+        else:
+            # a server not known to support binary values would store them unencoded
+            _request(addr, port, "PUT", path,
+                     body=codec.dumps_base64(value, to_ascii=False))
+    except (http.client.HTTPException, OSError) as e:
+        raise RuntimeError("Put data input KVStore server failed.", e)
+
+
+def read_many_from_kvstore(addr, port, scope, keys):
+    """
+    Reads the values of all given keys of the scope with a single request.
+    :return: dict of key to value
+    """
+    try:
+        path = "/{scope}/{key}".format(scope=scope, key=BATCH_KEY)
+        data = _request(addr, port, "GET", path,
+                        body=json.dumps(list(keys)).encode('utf-8'))
+        values = json.loads(data.decode('utf-8'))
+        return {key: codec.loads_base64(value.encode('latin-1'))
+                for key, value in values.items()}
+    except (http.client.HTTPException, OSError) as e:
+        raise RuntimeError("Read data from KVStore server failed.", e)
+
+
+def put_many_into_kvstore(addr, port, scope, values):
+    """
+    Puts all given key-value pairs into the scope with a single request.
+    :param values: dict of key to value
+    """
+    try:
+        path = "/{scope}/{key}".format(scope=scope, key=BATCH_KEY)
+        body = {key: codec.dumps_base64(value) for key, value in values.items()}
+        _request(addr, port, "PUT", path,
+                 body=json.dumps(body).encode('utf-8'))
+    except (http.client.HTTPException, OSError) as e:
         raise RuntimeError("Put data input KVStore server failed.", e)
@@ -13,7 +13,9 @@
 # limitations under the License.
 # =============================================================================
 
+import binascii
 import collections
+import json
 import logging
 import socket
 import socketserver
@@ -21,6 +23,7 @@ import threading
 
 from http.server import HTTPServer, SimpleHTTPRequestHandler
 
+from horovod.runner.common.util import codec
 from horovod.runner.util.network import find_port
 from horovod.runner.util.threads import in_thread
 
@@ -31,11 +34,34 @@ BAD_REQUEST = 400
 TIMEOUT = 408
 OK = 200
 
+# Key that addresses multiple keys of a scope within a single request
+BATCH_KEY = '_batch'
+
+# Values are stored base64 encoded. Clients can send and receive them
+# unencoded by using this content type instead.
+BINARY_CONTENT_TYPE = 'application/octet-stream'
+
+# Header sent with every response to advertise support of BINARY_CONTENT_TYPE
+BINARY_SUPPORT_HEADER = 'X-KVStore-Binary'
+
 
 class KVStoreHandler(SimpleHTTPRequestHandler):
     # Set timeout
     timeout = SINGLE_REQUEST_TIMEOUT
 
+    # Allow persistent connections, see parse_request
+    protocol_version = 'HTTP/1.1'
+
+    def parse_request(self):
+        if not super(KVStoreHandler, self).parse_request():
+            return False
+        # Only keep the connection open if the client explicitly asks for it.
+        # Other clients (e.g. the Gloo HTTP store) rely on the server
+        # closing the connection after each response.
+        if self.headers.get('Connection', '').lower() != 'keep-alive':
+            self.close_connection = True
+        return True
+
     # Override GET handler
     def do_GET(self):
         paths = self.path.split('/')
@@ -47,15 +73,22 @@ class KVStoreHandler(SimpleHTTPRequestHandler):
             return
 
         _, scope, key = paths
+        if key == BATCH_KEY:
+            self._get_batch(scope)
+            return
+
         value = self._get_value(scope, key)
 
         if value is None:
             self.send_status_code(404)
+        elif BINARY_CONTENT_TYPE in self.headers.get('Accept', ''):
+            try:
+                self.send_value(codec.decode_base64(value), content_type=BINARY_CONTENT_TYPE)
+            except binascii.Error:
+                # value has not been stored by a Python client, send as is
+                self.send_value(value)
         else:
-            self.send_response(200)
-            self.send_header("Content-Length", str(len(value)))
-            self.end_headers()
-            self.wfile.write(value)
+            self.send_value(value)
 
     # Override PUT handler
     def do_PUT(self):
@@ -69,25 +102,91 @@ class KVStoreHandler(SimpleHTTPRequestHandler):
 
         _, scope, key = paths
 
+        value = self._read_body()
+        if value is None:
+            # If timeout, abort this request
+            self.send_status_code(TIMEOUT)
+            return
+
+        if key == BATCH_KEY:
+            self._put_batch(scope, value)
+            return
+
+        if self.headers.get('Content-Type') == BINARY_CONTENT_TYPE:
+            value = codec.encode_base64(value)
+
+        self._put_value(scope, key, value)
+        self.send_status_code(OK)
+
+    def _read_body(self):
         # Get body length
-        content_length = int(self.headers['Content-Length'])
+        content_length = int(self.headers.get('Content-Length', 0))
         try:
-            value = self.rfile.read(content_length)
+            return self.rfile.read(content_length)
         except socket.timeout:
             if self.server.verbose:
                 logging.error(
                     'KVStore ERROR: Timeout when receiving {content_bytes} '
                     'bytes, aborting this incomplete request.' .format(
                         content_bytes=content_length))
-
-            # If timeout, abort this request
+            return None
+
+    # Batch requests carry a JSON body: a list of keys for GET
+    # and a map of keys to values for PUT. Values are decoded as latin-1,
+    # which maps every byte to a single character, so that arbitrary
+    # binary values survive the JSON round trip.
+    def _get_batch(self, scope):
+        body = self._read_body()
+        if body is None:
             self.send_status_code(TIMEOUT)
             return
 
-        self._put_value(scope, key, value)
+        try:
+            keys = json.loads(body.decode('utf-8'))
+        except ValueError:
+            logging.error('KVStore ERROR: Invalid batch request body.')
+            self.send_status_code(BAD_REQUEST)
+            return
+
+        values = {}
+        for key in keys:
+            value = self._get_value(scope, key)
+            if value is None:
+                self.send_status_code(404)
+                return
+            values[key] = value.decode('latin-1')
+
+        self.send_value(json.dumps(values).encode('utf-8'))
+
+    def _put_batch(self, scope, body):
+        try:
+            values = json.loads(body.decode('utf-8'))
+        except ValueError:
+            logging.error('KVStore ERROR: Invalid batch request body.')
+            self.send_status_code(BAD_REQUEST)
+            return
+
+        for key, value in values.items():
+            self._put_value(scope, key, value.encode('latin-1'))
         self.send_status_code(OK)
 
+    def send_value(self, value, content_type=None):
+        self.send_response(OK)
+        if content_type is not None:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(value)))
+        self.end_headers()
+        self.wfile.write(value)
+
+    def end_headers(self):
+        self.send_header(BINARY_SUPPORT_HEADER, '1')
+        super(KVStoreHandler, self).end_headers()
+
     def send_status_code(self, status_code):
+        if status_code in (BAD_REQUEST, TIMEOUT):
+            # the request body may not have been consumed,
+            # the connection cannot be reused
+            self.close_connection = True
         self.send_response(status_code)
         self.send_header("Content-Length", 0)
         self.end_headers()
@@ -150,6 +249,10 @@ class RendezvousHandler(KVStoreHandler):
 
 
 class RendezvousHTTPServer(socketserver.ThreadingMixIn, HTTPServer, object):
+    # Persistent client connections are served by their own threads,
+    # those must not block server shutdown.
+    daemon_threads = True
+
     def __init__(self, addr, handler, verbose):
         # This class has to inherit from object since HTTPServer is an old-style
         # class that does not inherit from object.
@@ -218,7 +321,11 @@ class RendezvousServer:
         self._listen_thread.join()
 
 
-class KVStoreHTTPServer(HTTPServer, object):
+class KVStoreHTTPServer(socketserver.ThreadingMixIn, HTTPServer, object):
+    # Persistent client connections are served by their own threads,
+    # those must not block server shutdown.
+    daemon_threads = True
+
     def __init__(self, addr, handler, verbose):
         super(KVStoreHTTPServer, self).__init__(addr, handler)
 
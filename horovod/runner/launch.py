@@ -20,6 +20,7 @@ import io
 import os
 import sys
 import textwrap
+import time
 import warnings
 
 import yaml
@@ -30,15 +31,16 @@ from horovod.common.util import (extension_available,
                                  gloo_built, mpi_built,
                                  nccl_built, ddl_built, ccl_built)
 from horovod.runner.common.util import config_parser, hosts, safe_shell_exec, secret, timeout
+from horovod.runner.common.util import env as env_util
 from horovod.runner.common.util import settings as hvd_settings
 from horovod.runner.driver import driver_service
 from horovod.runner.elastic import settings as elastic_settings
 from horovod.runner.elastic import discovery
-from horovod.runner.util import cache, threads, network, lsf
+from horovod.runner.util import cache, threads, network, lsf, streams
 from horovod.runner.gloo_run import gloo_run, gloo_run_elastic
 from horovod.runner.mpi_run import mpi_run
 from horovod.runner.js_run import js_run, is_jsrun_installed
-from horovod.runner.http.http_client import read_data_from_kvstore, put_data_into_kvstore
+from horovod.runner.http.http_client import put_data_into_kvstore, read_many_from_kvstore
 from horovod.runner.http.http_server import KVStoreServer
 from horovod.runner.util.remote import get_remote_command
 
@@ -53,15 +55,70 @@ SSH_ATTEMPTS = 5
 
 SSH_CONNECT_TIMEOUT_S = 10
 
+# Upper bound of the exponential backoff between ssh attempts
+SSH_RETRY_MAX_BACKOFF_S = 10
+
+# Ssh errors that will not go away by retrying
+SSH_PERMANENT_ERRORS = ['Permission denied',
+                        'Could not resolve hostname',
+                        'Host key verification failed']
+
+
+def _get_parallel_ssh_client():
+    """
+    Imports the optional parallel-ssh package only when the ssh check needs it,
+    as importing it loads gevent and ssh2-python.
+    :return: the ParallelSSHClient class, or None if parallel-ssh is not installed.
+    """
+    try:
+        from pssh.clients import ParallelSSHClient
+    except ImportError:
+        return None
+    return ParallelSSHClient
+
+
+def _check_hosts_with_parallel_ssh(client_cls, host_addresses, ssh_port=None, ssh_identity_file=None,
+                                   start_timeout=None):
+    """
+    Runs the ssh check on all hosts concurrently through libssh2, without
+    spawning an ssh process per host. Each host is tried only once,
+    failed hosts are retried by the ssh binary check with its bounded backoff.
+    :param client_cls: the ParallelSSHClient class
+    :return: set of host addresses that could successfully be sshed into.
+    """
+    connect_timeout = SSH_CONNECT_TIMEOUT_S
+    if start_timeout is not None:
+        connect_timeout = max(min(connect_timeout, start_timeout.remaining()), 1)
+    kwargs = dict(num_retries=1,
+                  timeout=connect_timeout,
+                  pool_size=len(host_addresses))
+    if ssh_port is not None:
+        kwargs['port'] = ssh_port
+    if ssh_identity_file is not None:
+        kwargs['pkey'] = ssh_identity_file
+
+    try:
+        client = client_cls(host_addresses, **kwargs)
+        output = client.run_command('true', stop_on_errors=False)
+        client.join(output)
+    except Exception:
+        return set()
+
+    return {host_output.host for host_output in output
+            if host_output.exception is None and host_output.exit_code == 0}
+
 
 @cache.use_cache()
-def _check_all_hosts_ssh_successful(host_addresses, ssh_port=None, ssh_identity_file=None):
+def _check_all_hosts_ssh_successful(host_addresses, ssh_port=None, ssh_identity_file=None,
+                                    start_timeout=None):
     """
     checks if ssh can successfully be performed to all the hosts.
     :param host_addresses: list of addresses to ssh into. for example,
         ['worker-0','worker-1']
         ['10.11.11.11', '10.11.11.12']
     :type host_addresses: list(strings)
+    :param start_timeout: no further attempts are made when this timeout would run out while backing off
+    :type start_timeout: horovod.runner.common.util.timeout.Timeout
     :return: Returns True if all ssh was successful into all the addresses.
     """
 
@@ -69,20 +126,41 @@ def _check_all_hosts_ssh_successful(host_addresses, ssh_port=None, ssh_identity_
         exit_code = 1
         output_msg = ''
 
-        # Try ssh 5 times
+        # Try ssh 5 times, backing off exponentially between attempts
         for i in range(SSH_ATTEMPTS):
+            if i > 0:
+                backoff = min(2 ** (i - 1), SSH_RETRY_MAX_BACKOFF_S)
+                if start_timeout is not None and start_timeout.remaining() <= backoff:
+                    break
+                time.sleep(backoff)
+
+            # ssh reports errors on stderr, the stdout of 'true' is of no interest
             output = io.StringIO()
             try:
                 exit_code = safe_shell_exec.execute(command,
-                                                    stdout=output,
+                                                    stdout=streams.NullStream(),
                                                     stderr=output)
                 if exit_code == 0:
                     break
                 output_msg = output.getvalue()
             finally:
                 output.close()
+
+            if any(error in output_msg for error in SSH_PERMANENT_ERRORS):
+                break
         return exit_code, output_msg
 
+    parallel_ssh_client = None if env_util.is_kubeflow_mpi() else _get_parallel_ssh_client()
+    if parallel_ssh_client is not None:
+        # Hosts that fail this check (e.g. because they rely on ~/.ssh/config,
+        # which libssh2 does not read) are checked below with the ssh binary.
+        successful_hosts = _check_hosts_with_parallel_ssh(parallel_ssh_client, host_addresses,
+                                                          ssh_port, ssh_identity_file, start_timeout)
+        host_addresses = [host_address for host_address in host_addresses
+                          if host_address not in successful_hosts]
+        if not host_addresses:
+            return True
+
     args_list = [[get_remote_command(local_command='true',
                                      host=host_address,
                                      port=ssh_port,
@@ -261,7 +339,8 @@ def parse_args():
                              'the initialization checks only once every 60 '
                              'minutes -- if the checks successfully pass. '
                              'Otherwise, all the checks will run every time '
-                             'horovodrun is called.')
+                             'horovodrun is called. Reordering the hosts does '
+                             'not invalidate the cached checks.')
 
     parser.add_argument('--start-timeout', action='store',
                         dest='start_timeout', type=int,
@@ -558,16 +637,13 @@ def _run_static(args):
     # --disable-cache flag.
     fn_cache = None
     if not args.disable_cache:
-        params = ''
-        if args.np:
-            params += str(args.np) + ' '
-        if args.hosts:
-            params += str(args.hosts) + ' '
-        if args.ssh_port:
-            params += str(args.ssh_port)
-        if args.ssh_identity_file:
-            params += args.ssh_identity_file
-        parameters_hash = hashlib.md5(params.encode('utf-8')).hexdigest()
+        # the order of hosts does not change the outcome of the cached checks,
+        # so any permutation of the same hosts shares the cache
+        sorted_hosts = ','.join(sorted(host.strip() for host in args.hosts.split(',')))
+        params = ' '.join(str(param)
+                          for param in (args.np, sorted_hosts, args.ssh_port, args.ssh_identity_file)
+                          if param)
+        parameters_hash = hashlib.blake2b(params.encode('utf-8'), digest_size=16).hexdigest()
         fn_cache = cache.Cache(CACHE_FOLDER, CACHE_STALENESS_THRESHOLD_MINUTES,
                                parameters_hash)
 
@@ -582,8 +658,10 @@ def _run_static(args):
         if settings.verbose >= 2:
             print('Checking ssh on all remote hosts.')
         # Check if we can ssh into all remote hosts successfully.
-        if not _check_all_hosts_ssh_successful(remote_host_names, args.ssh_port, args.ssh_identity_file,
-                                               fn_cache=fn_cache):
+        # the start timeout is passed positionally so that it does not become part of the cache key,
+        # hosts are sorted as their order is part of the cache key
+        if not _check_all_hosts_ssh_successful(sorted(remote_host_names), args.ssh_port, args.ssh_identity_file,
+                                               settings.start_timeout, fn_cache=fn_cache):
             raise RuntimeError('could not connect to some hosts via ssh')
         if settings.verbose >= 2:
             print('SSH was successful into all the remote hosts.')
@@ -604,12 +682,9 @@ def _run_static(args):
 
         try:
             _launch_job(args, settings, nics, command)
-            results = [None] * args.np
-            # TODO: make it parallel to improve performance
-            for i in range(args.np):
-                results[i] = read_data_from_kvstore(driver_ip, run_func_server_port,
-                                                    'runfunc_result', str(i))
-            return results
+            results = read_many_from_kvstore(driver_ip, run_func_server_port,
+                                             'runfunc_result', [str(i) for i in range(args.np)])
+            return [results[str(i)] for i in range(args.np)]
         finally:
             run_func_server.shutdown_server()
     else:
@@ -15,6 +15,8 @@
 
 import sys
 
+import cloudpickle
+
 from horovod.runner.common.util import codec, host_hash
 from horovod.runner.driver import driver_service
 from horovod.runner.task import task_service
@@ -54,13 +56,18 @@ def _task_fn(index, num_hosts, driver_addresses, settings):
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 5:
-        print('Usage: {} <index> <num_hosts> <driver_addresses> <settings>'.format(sys.argv[0]))
+    if len(sys.argv) not in [2, 5]:
+        print('Usage: {} <index> [<num_hosts> <driver_addresses> <settings>]\n'
+              'Reads the pickled tuple (num_hosts, driver_addresses, settings) '
+              'from stdin if only the index is given.'.format(sys.argv[0]))
         sys.exit(1)
 
     index = codec.loads_base64(sys.argv[1])
-    num_hosts = codec.loads_base64(sys.argv[2])
-    driver_addresses = codec.loads_base64(sys.argv[3])
-    settings = codec.loads_base64(sys.argv[4])
+    if len(sys.argv) == 2:
+        num_hosts, driver_addresses, settings = cloudpickle.loads(sys.stdin.buffer.read())
+    else:
+        num_hosts = codec.loads_base64(sys.argv[2])
+        driver_addresses = codec.loads_base64(sys.argv[3])
+        settings = codec.loads_base64(sys.argv[4])
 
     _task_fn(index, num_hosts, driver_addresses, settings)
@@ -74,3 +74,17 @@ class Pipe:
         finally:
             self._wait_cond.notify_all()
             self._wait_cond.release()
+
+
+class NullStream:
+    """
+    A stream that discards everything written to it.
+    """
+    def write(self, buf):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
@@ -13,9 +13,71 @@
 # limitations under the License.
 # ==============================================================================
 
+import concurrent.futures
+import os
 import queue
 import threading
 
+# Upper bound of threads in the shared pool, threads are only created on demand
+MAX_POOL_THREADS = 1000
+
+_executor = None
+_executor_pid = None
+_executor_tasks = 0
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """
+    Returns the thread pool shared by all blocking execute_function_multithreaded calls,
+    so that threads are reused across calls rather than created and torn down every time.
+    A forked child process does not inherit the pool's threads, so it gets its own pool.
+    Returns None when all threads of the pool are busy, the caller has to use a dedicated
+    thread then, so that concurrent calls never queue behind each other's long-running tasks.
+    Otherwise a pool thread is reserved for the caller, which is released when the task is done.
+    """
+    global _executor, _executor_pid, _executor_tasks
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_POOL_THREADS,
+                                                              thread_name_prefix='horovod-runner')
+            _executor_pid = os.getpid()
+            _executor_tasks = 0
+        if _executor_tasks >= MAX_POOL_THREADS:
+            return None
+        _executor_tasks += 1
+        return _executor
+
+
+def _release_executor_task(future):
+    global _executor_tasks
+    with _executor_lock:
+        _executor_tasks -= 1
+
+
+def _submit(fn):
+    """
+    Executes fn in a thread of the shared pool, or in a dedicated daemon thread if the pool is busy.
+    :return: future of the execution
+    """
+    executor = _get_executor()
+    if executor is not None:
+        future = executor.submit(fn)
+        future.add_done_callback(_release_executor_task)
+        return future
+
+    future = concurrent.futures.Future()
+
+    def run():
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+
+    in_thread(target=run, daemon=True)
+    return future
+
 
 def execute_function_multithreaded(fn,
                                    args_list,
@@ -30,6 +92,9 @@ def execute_function_multithreaded(fn,
     :type args_list: list(list)
     :param block_until_all_done: if is True, function will block until all the
     threads are done and will return the results of each thread's execution.
+    Those threads are taken from a pool shared across calls, or are dedicated
+    threads while all threads of the pool are busy. Otherwise, fn is
+    executed in dedicated daemon threads.
     :type block_until_all_done: bool
     :param max_concurrent_executions:
     :type max_concurrent_executions: int
@@ -58,36 +123,32 @@ def execute_function_multithreaded(fn,
             res = fn(*arg[:-1])
             result_queue.put((exec_index, res))
 
-    threads = []
     number_of_threads = min(max_concurrent_executions, len(args_list))
 
-    for _ in range(number_of_threads):
-        thread = in_thread(target=fn_execute, daemon=not block_until_all_done)
-        threads.append(thread)
-
     # Returns the results only if block_until_all_done is set.
-    results = None
-    if block_until_all_done:
-
-        # Because join() cannot be interrupted by signal, a single join()
-        # needs to be separated into join()s with timeout in a while loop.
-        have_alive_child = True
-        while have_alive_child:
-            have_alive_child = False
-            for t in threads:
-                t.join(0.1)
-                if t.is_alive():
-                    have_alive_child = True
-
-        results = {}
-        while not result_queue.empty():
-            item = result_queue.get()
-            results[item[0]] = item[1]
-
-        if len(results) != len(args_list):
-            raise RuntimeError(
-                'Some threads for func {func} did not complete '
-                'successfully.'.format(func=fn.__name__))
+    if not block_until_all_done:
+        for _ in range(number_of_threads):
+            in_thread(target=fn_execute, daemon=True)
+        return None
+
+    futures = [_submit(fn_execute) for _ in range(number_of_threads)]
+
+    # Wait in short intervals so that signals get handled while waiting.
+    not_done = futures
+    while not_done:
+        _, not_done = concurrent.futures.wait(not_done, timeout=0.1)
+
+    results = {}
+    while not result_queue.empty():
+        item = result_queue.get()
+        results[item[0]] = item[1]
+
+    if len(results) != len(args_list):
+        exceptions = [future.exception() for future in futures if future.exception()]
+        raise RuntimeError(
+            'Some threads for func {func} did not complete '
+            'successfully.'.format(func=fn.__name__)) \
+            from (exceptions[0] if exceptions else None)
     return results
 
 
@@ -163,3 +224,50 @@ def on_event(event, func, args=(),
                 func(*args)
 
     return in_thread(fn, daemon=daemon, silent=silent)
+
+
+def on_any_event(events, func, args=(),
+                 stop=None, check_interval_s=0.1,
+                 daemon=True, silent=False):
+    """
+    Executes the given function in a separate thread when any of the given events is set.
+    A single thread waits for all events, rather than one thread per event as with on_event.
+    The thread returns immediately when the first event is set, other events are
+    checked every check_interval_s, as is the optional stop event.
+    Exceptions will silently be swallowed when silent is True.
+
+    :param events: events that trigger func
+    :type events: list(threading.Event)
+    :param func: function to trigger
+    :param args: function arguments
+    :param stop: event to stop thread
+    :type stop: threading.Event
+    :param check_interval_s: interval in seconds to check the events and the stop event
+    :type check_interval_s: float
+    :param daemon: event thread is a daemon thread if set to True, otherwise stop event must be given
+    :param silent: swallows exceptions raised by target silently
+    :return: thread
+    """
+    if not events or any(event is None for event in events):
+        raise ValueError('Events must not be empty or None')
+
+    if len(events) == 1:
+        return on_event(events[0], func, args, stop=stop, check_stop_interval_s=check_interval_s,
+                        daemon=daemon, silent=silent)
+
+    if not isinstance(args, tuple):
+        raise ValueError('args must be a tuple, not {}, for a single argument use (arg,)'
+                         .format(type(args)))
+
+    if stop is None and not daemon:
+        raise ValueError('Stop event must be given for non-daemon event thread')
+
+    def fn():
+        while not any(event.is_set() for event in events):
+            if stop is not None and stop.is_set():
+                return
+            events[0].wait(timeout=check_interval_s)
+        if stop is None or not stop.is_set():
+            func(*args)
+
+    return in_thread(fn, daemon=daemon, silent=silent)
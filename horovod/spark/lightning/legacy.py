@@ -13,6 +13,8 @@
 # limitations under the License.
 # ==============================================================================
 
+import operator
+
 import torch
 
 from pytorch_lightning import LightningModule
@@ -20,18 +22,31 @@ from pytorch_lightning import LightningModule
 from horovod.spark.common.util import to_list
 
 
+def _columns_getter(cols):
+    # operator.itemgetter only returns a tuple for more than one column
+    if len(cols) > 1:
+        return operator.itemgetter(*cols)
+    return lambda batch: tuple(batch[col] for col in cols)
+
+
 def to_lightning_module(model, optimizer, loss_fns, loss_weights, feature_cols, label_cols, sample_weights_col,
                         validation):
     optimizer_cls = optimizer.__class__
     optimizer_state = optimizer.state_dict()
 
-    loss_weights = loss_weights or [1.0 / len(label_cols)] * len(label_cols)
-    loss_fns = to_list(loss_fns, len(label_cols))
+    num_outputs = len(label_cols)
+    loss_weights = torch.tensor(loss_weights or [1.0 / num_outputs] * num_outputs)
+    loss_fns = tuple(to_list(loss_fns, num_outputs))
+
+    get_features = _columns_getter(feature_cols)
+    get_labels = _columns_getter(label_cols)
 
     class _EstimatorLightningModule(LightningModule):
         def __init__(self):
             super().__init__()
             self._model = model
+            # moved to the device and dtype of the losses on first use
+            self._loss_weights = loss_weights
 
         def forward(self, *args, **kwargs):
             return self._model(*args, **kwargs)
@@ -54,19 +69,20 @@ def to_lightning_module(model, optimizer, loss_fns, loss_weights, feature_cols,
             return {'loss': loss, 'log': tensorboard_logs}
 
         def _step(self, batch):
-            inputs = {feature: batch[feature].float() for feature in feature_cols}
-            labels = [batch[label].float() for label in label_cols]
+            inputs = dict(zip(feature_cols, (feature.float() for feature in get_features(batch))))
+            labels = [label.float() for label in get_labels(batch)]
             sample_weights = batch[sample_weights_col].float() if sample_weights_col else None
             outputs = self(**inputs)
             outputs, labels = self._transform_outputs(outputs, labels)
             return self._calculate_loss(outputs, labels, sample_weights)
 
         def _transform_outputs(self, outputs, labels):
-            if type(outputs) != tuple and type(outputs) != list:
+            if not isinstance(outputs, (tuple, list)):
                 outputs = [outputs]
 
-            # reshape labels to match the output shape of the model
-            if hasattr(outputs[0], 'shape'):
+            # reshape labels to match the output shape of the model, unless all shapes match already
+            if hasattr(outputs[0], 'shape') and \
+                    not all(output.shape == label.shape for output, label in zip(outputs, labels)):
                 labels = [label.reshape(output.shape)
                           if output.shape.numel() == label.shape.numel() else label
                           for label, output in zip(labels, outputs)]
@@ -82,19 +98,17 @@ def to_lightning_module(model, optimizer, loss_fns, loss_weights, feature_cols,
                 # the weights and divide the sum to the sum of weights, the impact of two
                 # samples with identical weights but in different batches will not be equal on
                 # the calculated gradients.
-                losses = []
-                for output, label, loss_fn, loss_weight in zip(outputs, labels,
-                                                               loss_fns, loss_weights):
-                    weight_adjusted_sample_losses = \
-                        loss_fn(output, label, reduction='none').flatten() * sample_weights
-                    output_loss = weight_adjusted_sample_losses.mean()
-                    losses.append(output_loss * loss_weight)
+                losses = [(loss_fn(output, label, reduction='none').flatten() * sample_weights).mean()
+                          for output, label, loss_fn in zip(outputs, labels, loss_fns)]
             else:
-                losses = [loss_fn(output, label) * loss_weight for
-                          output, label, loss_fn, loss_weight in
-                          zip(outputs, labels, loss_fns, loss_weights)]
-
-            loss = sum(losses)
+                losses = [loss_fn(output, label)
+                          for output, label, loss_fn in zip(outputs, labels, loss_fns)]
+
+            # weight and reduce all output losses with a single op rather than one op per output
+            losses = torch.stack(losses)
+            if self._loss_weights.device != losses.device or self._loss_weights.dtype != losses.dtype:
+                self._loss_weights = self._loss_weights.to(device=losses.device, dtype=losses.dtype)
+            loss = (losses * self._loss_weights[:len(losses)]).sum()
             return loss
 
     lightning_module = _EstimatorLightningModule()
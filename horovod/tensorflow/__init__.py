@@ -243,32 +243,32 @@ def grouped_allreduce(tensors, average=None, device_dense='', device_sparse='',
                     new_tensors = summed_tensors
         return new_tensors
 
-def _allreduce_cond(tensor, *args, process_set=global_process_set, **kwargs):
+def _allreduce_pred(process_set=global_process_set):
+    """Predicate whether this process has to take part in an allreduce of the given process set."""
+    return tf.logical_and(
+        tf.equal(process_set_included_op(process_set.process_set_id), 1),
+        tf.greater(size_op(process_set.process_set_id), 1)) \
+        if int(os.environ.get("HOROVOD_ELASTIC", 0)) else (
+        tf.convert_to_tensor(process_set.included() and process_set.size() > 1))
+
+def _allreduce_cond(tensor, *args, process_set=global_process_set, pred=None, **kwargs):
     def allreduce_fn():
         return allreduce(tensor, *args, process_set=process_set, **kwargs)
 
     def id_fn():
         return tensor
 
-    return tf.cond(tf.logical_and(
-        tf.equal(process_set_included_op(process_set.process_set_id), 1),
-        tf.greater(size_op(process_set.process_set_id), 1))
-                   if int(os.environ.get("HOROVOD_ELASTIC", 0)) else (
-        tf.convert_to_tensor(process_set.included() and process_set.size() > 1)),
+    return tf.cond(pred if pred is not None else _allreduce_pred(process_set),
                    allreduce_fn, id_fn)
 
-def _grouped_allreduce_cond(tensors, *args, process_set=global_process_set, **kwargs):
+def _grouped_allreduce_cond(tensors, *args, process_set=global_process_set, pred=None, **kwargs):
     def allreduce_fn():
         return grouped_allreduce(tensors, *args, process_set=process_set, **kwargs)
 
     def id_fn():
         return tensors
 
-    return tf.cond(tf.logical_and(
-        tf.equal(process_set_included_op(process_set.process_set_id), 1),
-        tf.greater(size_op(process_set.process_set_id), 1))
-                   if int(os.environ.get("HOROVOD_ELASTIC", 0)) else (
-        tf.convert_to_tensor(process_set.included() and process_set.size() > 1)),
+    return tf.cond(pred if pred is not None else _allreduce_pred(process_set),
                    allreduce_fn, id_fn)
 
 
@@ -368,6 +368,9 @@ def _make_cached_allreduce_grads_fn(name, device_dense, device_sparse,
 
     def allreduce_grads(grads, vars=None):
         with tf.name_scope(name + "_Allreduce"):
+            # all gradients share the same predicate, rather than building one per gradient
+            pred = _allreduce_pred(process_set)
+
             if sparse_as_dense:
                 grads = [tf.convert_to_tensor(grad)
                          if grad is not None and isinstance(grad, tf.IndexedSlices)
@@ -405,7 +408,8 @@ def _make_cached_allreduce_grads_fn(name, device_dense, device_sparse,
                                                                op=op,
                                                                prescale_factor=prescale_factor,
                                                                postscale_factor=postscale_factor,
-                                                               process_set=process_set)
+                                                               process_set=process_set,
+                                                               pred=pred)
                     for i in range(len(index_group)):
                         reduce_ops[index_group[i]] = reduce_ops_group[i]
                 return reduce_ops
@@ -417,7 +421,8 @@ def _make_cached_allreduce_grads_fn(name, device_dense, device_sparse,
                                     op=op,
                                     prescale_factor=prescale_factor,
                                     postscale_factor=postscale_factor,
-                                    process_set=process_set)
+                                    process_set=process_set,
+                                    pred=pred)
                     if grad is not None else grad
                     for grad in grads]
 
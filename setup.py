@@ -114,6 +114,7 @@ pyspark_require_list = ['pyspark>=2.3.2;python_version<"3.8"',
 # Pin h5py: https://github.com/h5py/h5py/issues/1732
 spark_require_list = ['h5py<3', 'numpy', 'petastorm>=0.11.0', 'pyarrow>=0.15.0', 'fsspec']
 ray_require_list = ['ray']
+parallel_ssh_require_list = ['parallel-ssh']
 pytorch_spark_require_list = pytorch_require_list + \
                              spark_require_list + \
                              pyspark_require_list
@@ -189,6 +190,7 @@ setup(name='horovod',
           'spark': spark_require_list + pyspark_require_list,
           'pytorch-spark': pytorch_spark_require_list,
           'ray': ray_require_list,
+          'parallel-ssh': parallel_ssh_require_list,
           'dev': dev_require_list,
           'test': test_require_list,
       },
@@ -19,6 +19,7 @@ import itertools
 import logging
 import multiprocessing
 import os
+import socket
 import subprocess
 import sys
 import threading
@@ -33,17 +34,21 @@ from mock import MagicMock
 
 import horovod
 from horovod.runner import _HorovodArgs
-from horovod.runner.common.util import config_parser, hosts, safe_shell_exec, secret, \
+from horovod.runner.common.util import codec, config_parser, hosts, safe_shell_exec, secret, \
     settings as hvd_settings, timeout
 from horovod.runner.common.util.host_hash import _hash, host_hash
 from horovod.runner.common.util.hosts import SlotInfo, get_host_assignments, parse_hosts
 from horovod.runner.gloo_run import gloo_run
+from horovod.runner.http import http_client
+from horovod.runner.http.http_server import KVStoreServer
 from horovod.runner.js_run import js_run, generate_jsrun_rankfile
-from horovod.runner.launch import gloo_built, parse_args, run_controller, _run
+from horovod.runner.launch import gloo_built, parse_args, run_controller, _run, \
+    _check_all_hosts_ssh_successful
 from horovod.runner.mpi_run import _get_mpi_implementation, _get_mpi_implementation_flags, \
     _LARGE_CLUSTER_THRESHOLD as large_cluster_threshold, mpi_available, mpi_run, \
     _OMPI_IMPL, _SMPI_IMPL, _MPICH_IMPL, _IMPI_IMPL, _UNKNOWN_IMPL, _MISSING_IMPL
-from horovod.runner.util.threads import in_thread, on_event
+from horovod.runner.util import threads
+from horovod.runner.util.threads import execute_function_multithreaded, in_thread, on_any_event, on_event
 
 sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir, 'utils'))
 
@@ -262,6 +267,72 @@ class RunTests(unittest.TestCase):
             in_thread(fn, args=1)
         fn.assert_not_called()
 
+    @mock.patch('horovod.runner.util.threads._executor', None)
+    def test_execute_function_multithreaded(self):
+        thread_names = set()
+
+        def fn(value):
+            thread_names.add(threading.current_thread().name)
+            return value * 2
+
+        for _ in range(3):
+            results = execute_function_multithreaded(fn, [[i] for i in range(4)],
+                                                     max_concurrent_executions=2)
+            self.assertEqual({i: i * 2 for i in range(4)}, results)
+        # threads are reused across calls
+        self.assertLessEqual(len(thread_names), 2)
+
+        def fail(value):
+            raise ValueError(value)
+
+        with pytest.raises(RuntimeError, match='did not complete successfully') as e:
+            execute_function_multithreaded(fail, [[1]])
+        self.assertIsInstance(e.value.__cause__, ValueError)
+
+    @mock.patch('horovod.runner.util.threads._executor', None)
+    @mock.patch('horovod.runner.util.threads.MAX_POOL_THREADS', 2)
+    def test_execute_function_multithreaded_with_busy_pool(self):
+        # long-running tasks occupy all threads of the pool
+        release = threading.Event()
+        busy = in_thread(execute_function_multithreaded, (lambda _: release.wait(), [[0], [1]]))
+        wait(lambda: threads._executor_tasks == 2, timeout=5)
+
+        # other calls do not queue behind those tasks but run in dedicated threads
+        self.assertEqual({0: 0, 1: 2}, execute_function_multithreaded(lambda value: value * 2, [[0], [1]]))
+        self.assertEqual(2, threads._executor_tasks)
+
+        release.set()
+        busy.join(5)
+        self.assertFalse(busy.is_alive())
+        wait(lambda: threads._executor_tasks == 0, timeout=5)
+
+    def test_on_any_event(self):
+        with pytest.raises(ValueError):
+            on_any_event([], mock.Mock())
+
+        # setting any of the events triggers fn exactly once
+        for index in range(3):
+            events = [threading.Event() for _ in range(3)]
+            fn = mock.Mock()
+            thread = on_any_event(events, fn, ('a', 1), check_interval_s=0.01)
+            fn.assert_not_called()
+            events[index].set()
+            thread.join(1.0)
+            self.assertFalse(thread.is_alive())
+            fn.assert_called_once_with('a', 1)
+
+        # stop the thread before we set any event
+        events = [threading.Event() for _ in range(2)]
+        stop = threading.Event()
+        fn = mock.Mock()
+        thread = on_any_event(events, fn, stop=stop, check_interval_s=0.01)
+        stop.set()
+        thread.join(1.0)
+        self.assertFalse(thread.is_alive())
+        events[1].set()
+        time.sleep(0.1)
+        fn.assert_not_called()
+
     def test_on_event(self):
         # a happy run without args and stop event
         event = threading.Event()
@@ -378,14 +449,44 @@ class RunTests(unittest.TestCase):
                                                 '[123]<prefix>:' + block + '\n')
 
     def test_prefix_connection_with_timestamp(self):
+        # lines read at once share the same timestamp
         string = 'first line\nsecond line\nmore lines\n'
         self.do_test_prefix_connection_with_timestamp(
             string, prefix='prefix', index=123,
             expected='Mon Jan 20 12:00:01 2020[123]<prefix>:first line\n'
-                     'Mon Jan 20 12:00:02 2020[123]<prefix>:second line\n'
-                     'Mon Jan 20 12:00:03 2020[123]<prefix>:more lines\n'
+                     'Mon Jan 20 12:00:01 2020[123]<prefix>:second line\n'
+                     'Mon Jan 20 12:00:01 2020[123]<prefix>:more lines\n'
         )
 
+    def test_prefixed_stream_line_spanning_writes(self):
+        dst = io.StringIO()
+        stream = safe_shell_exec._PrefixedStream(dst, prefix='prefix', index=1,
+                                                 prefix_output_with_timestamp=False)
+        for text in ['first ', 'line ', 'continues\nsecond ', 'line\r', 'last ', 'line']:
+            stream.write(text.encode('utf8'))
+        self.assertEqual('[1]<prefix>:first line continues\n[1]<prefix>:second line\r', dst.getvalue())
+        stream.write(b'')
+        self.assertEqual('[1]<prefix>:first line continues\n[1]<prefix>:second line\r'
+                         '[1]<prefix>:last line', dst.getvalue())
+
+    def test_prefixed_stream_timestamp(self):
+        dst = io.StringIO()
+        stream = safe_shell_exec._PrefixedStream(dst, prefix='prefix', index=1,
+                                                 prefix_output_with_timestamp=True)
+        # 2020-01-20 12:00:00
+        with mock.patch('horovod.runner.common.util.safe_shell_exec.time.time',
+                        side_effect=[1579521600.1, 1579521600.9, 1579521601.5]), \
+                mock.patch('horovod.runner.common.util.safe_shell_exec.time.localtime',
+                           side_effect=time.gmtime) as localtime:
+            stream.write(b'first line\n')
+            stream.write(b'second line\n')
+            stream.write(b'third line\n')
+        self.assertEqual('Mon Jan 20 12:00:00 2020[1]<prefix>:first line\n'
+                         'Mon Jan 20 12:00:00 2020[1]<prefix>:second line\n'
+                         'Mon Jan 20 12:00:01 2020[1]<prefix>:third line\n', dst.getvalue())
+        # the timestamp is only formatted when the second changes
+        self.assertEqual(2, localtime.call_count)
+
     def test_prefix_connection_with_timestamp_without_index(self):
         string = 'first line\nsecond line\nmore lines\n'
         self.do_test_prefix_connection_with_timestamp(string, prefix=None, index=None,
@@ -421,6 +522,89 @@ class RunTests(unittest.TestCase):
         string = 'first line\rfirst line again\nsecond line\n'
         self.do_test_prefix_connection(string, prefix=None, index=123, expected=string)
 
+    def test_prefix_connection_with_large_output(self):
+        # output exceeding the read buffer size is read in multiple chunks,
+        # lines and multi-byte characters span the chunk boundaries
+        lines = ['line {} ∀'.format(i) * 10 for i in range(5000)]
+        string = '\n'.join(lines)
+        self.assertGreater(len(string.encode('utf8')), 2 * safe_shell_exec.READ_BUFFER_SIZE)
+
+        (connection, w) = multiprocessing.get_context('spawn').Pipe(duplex=False)
+
+        def writer():
+            with os.fdopen(w.fileno(), 'wt', encoding='utf8', newline='', closefd=False) as stream:
+                stream.write(string)
+            w.close()
+
+        writer_thread = in_thread(writer)
+        dst = io.StringIO()
+        safe_shell_exec.prefix_connection(connection, dst, prefix='prefix', index=1,
+                                          prefix_output_with_timestamp=False)
+        writer_thread.join()
+        self.assertEqual(''.join('[1]<prefix>:{}\n'.format(line) for line in lines)[:-1], dst.getvalue())
+
+    def test_prefix_connection_with_long_line(self):
+        # a single line spanning many reads, scanning it for line ends must take linear time
+        line = 'x' * (1 << 20)
+        (connection, w) = multiprocessing.get_context('spawn').Pipe(duplex=False)
+
+        def writer():
+            os.write(w.fileno(), line.encode('utf8') + b'\n')
+            w.close()
+
+        writer_thread = in_thread(writer)
+        dst = io.StringIO()
+        start = time.time()
+        safe_shell_exec.prefix_connection(connection, dst, prefix='prefix', index=1,
+                                          prefix_output_with_timestamp=False)
+        writer_thread.join()
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual('[1]<prefix>:{}\n'.format(line), dst.getvalue())
+
+    def test_prefix_connection_coalesces_writes(self):
+        (connection, w) = multiprocessing.get_context('spawn').Pipe(duplex=False)
+        os.write(w.fileno(), 'first line\nsecond line\nmore lines\n'.encode('utf8'))
+        w.close()
+
+        dst = mock.MagicMock(spec=io.StringIO)
+        safe_shell_exec.prefix_connection(connection, dst, prefix='prefix', index=1,
+                                          prefix_output_with_timestamp=False)
+        dst.write.assert_called_once_with('[1]<prefix>:first line\n'
+                                          '[1]<prefix>:second line\n'
+                                          '[1]<prefix>:more lines\n')
+        dst.flush.assert_called_once_with()
+
+    def test_prefix_connection_with_failing_stream(self):
+        class FailingStream:
+            def __init__(self):
+                self.writes = 0
+
+            def write(self, text):
+                self.writes += 1
+                raise RuntimeError('failing stream')
+
+            def flush(self):
+                pass
+
+        (connection, w) = multiprocessing.get_context('spawn').Pipe(duplex=False)
+        dst = FailingStream()
+
+        # the pipe is drained after the failing write, so writing more than its capacity does not block
+        def write():
+            os.write(w.fileno(), b'first line\n')
+            os.write(w.fileno(), b'x' * (1 << 20))
+            w.close()
+
+        writer = in_thread(write)
+        with mock.patch('horovod.runner.common.util.safe_shell_exec.traceback.print_exc') as print_exc:
+            safe_shell_exec.prefix_connection(connection, dst, prefix='stdout', index=1,
+                                              prefix_output_with_timestamp=False)
+        writer.join(5)
+        self.assertFalse(writer.is_alive())
+        print_exc.assert_called_once_with()
+        self.assertEqual(1, dst.writes)
+        self.assertTrue(connection.closed)
+
     def do_test_prefix_connection(self, string, prefix, index, expected, timestamp=False):
         # create a Pipe Connection and populate it with string
         (connection, w) = multiprocessing.get_context('spawn').Pipe(duplex=False)
@@ -547,6 +731,11 @@ class RunTests(unittest.TestCase):
         cmd = 'bash -c "echo -e -n \\"hello\nstdout\\"; echo -e -n \\"hello\nstderr\\" >&2"'
         self.do_test_safe_shell_exec(cmd, 0, 'hello\nstdout', 'hello\nstderr')
 
+    def test_safe_shell_exec_with_argument_list(self):
+        # arguments are not interpreted by a shell
+        self.do_test_safe_shell_exec(['echo', 'hello $HOME; exit 1'], 0, 'hello $HOME; exit 1\n', '')
+        self.do_test_safe_shell_exec([sys.executable, '-c', 'import sys; sys.exit(3)'], 3, '', '')
+
     def test_safe_shell_exec_returns_exit_code(self):
         self.do_test_safe_shell_exec('false', 1, '', '')
 
@@ -609,6 +798,144 @@ class RunTests(unittest.TestCase):
         if expected_stderr is not None:
             self.assertEqual(expected_stderr, stderr.getvalue())
 
+    def test_safe_shell_exec_with_fork_context(self):
+        with override_env({safe_shell_exec.HOROVOD_MP_CONTEXT: 'fork'}):
+            self.assertEqual('fork', safe_shell_exec._get_mp_context().get_start_method())
+            self.do_test_safe_shell_exec('echo hello', 0, 'hello\n', '')
+
+    @pytest.mark.skipif(not sys.platform.startswith('linux'), reason='requires /proc')
+    def test_safe_shell_exec_with_fork_context_closes_read_ends(self):
+        # both ends of a pipe link to the same pipe inode, the middleman ($PPID) holds only the write end
+        cmd = 'readlink /proc/$PPID/fd/* | grep -cxF "$(readlink /proc/$$/fd/1)"'
+        with override_env({safe_shell_exec.HOROVOD_MP_CONTEXT: 'fork'}):
+            self.do_test_safe_shell_exec(cmd, 0, '1\n', '')
+
+    def test_safe_shell_exec_with_forkserver_context(self):
+        with override_env({safe_shell_exec.HOROVOD_MP_CONTEXT: 'forkserver'}):
+            self.assertEqual('forkserver', safe_shell_exec._get_mp_context().get_start_method())
+            for _ in range(2):
+                self.do_test_safe_shell_exec('echo hello', 0, 'hello\n', '')
+
+    def test_safe_shell_exec_stdin(self):
+        stdout = io.StringIO()
+        res = safe_shell_exec.execute('cat', stdout=stdout, stdin=b'line 1\nline 2\n')
+        self.assertEqual(0, res)
+        self.assertEqual('line 1\nline 2\n', stdout.getvalue())
+
+        # commands may exit without consuming stdin
+        stdout = io.StringIO()
+        res = safe_shell_exec.execute('echo hello', stdout=stdout, stdin=b'x' * 1024 * 1024)
+        self.assertEqual(0, res)
+        self.assertEqual('hello\n', stdout.getvalue())
+
+    def test_safe_shell_exec_with_failing_stream(self):
+        stdout = mock.Mock()
+        stdout.write.side_effect = RuntimeError('failing stream')
+        stderr = io.StringIO()
+        with mock.patch('horovod.runner.common.util.safe_shell_exec.traceback.print_exc'):
+            res = safe_shell_exec.execute('echo out; sleep 0.5; echo err1 >&2; echo err2 >&2',
+                                          stdout=stdout, stderr=stderr)
+        self.assertEqual(0, res)
+        self.assertEqual('err1\nerr2\n', stderr.getvalue())
+
+    def test_kvstore_reuses_connection(self):
+        server = KVStoreServer(verbose=0)
+        port = server.start_server()
+        try:
+            http_client.put_data_into_kvstore('127.0.0.1', port, 'scope', 'key', {'value': 1})
+            conn = http_client._get_connection('127.0.0.1', port)
+            self.assertEqual({'value': 1},
+                             http_client.read_data_from_kvstore('127.0.0.1', port, 'scope', 'key'))
+            self.assertIs(conn, http_client._get_connection('127.0.0.1', port))
+
+            # reconnects once the server closed the idle connection
+            conn.sock.shutdown(2)
+            http_client.put_data_into_kvstore('127.0.0.1', port, 'scope', 'key', {'value': 2})
+            self.assertEqual({'value': 2},
+                             http_client.read_data_from_kvstore('127.0.0.1', port, 'scope', 'key'))
+
+            with pytest.raises(RuntimeError):
+                http_client.read_data_from_kvstore('127.0.0.1', port, 'scope', 'unknown')
+        finally:
+            server.shutdown_server()
+
+    def test_kvstore_binary_values(self):
+        server = KVStoreServer(verbose=0)
+        port = server.start_server()
+        try:
+            value = {'data': bytes(range(256)) * 10}
+            with mock.patch.dict('horovod.runner.http.http_client._binary_support', clear=True):
+                with mock.patch('horovod.runner.http.http_client._request',
+                                wraps=http_client._request) as request:
+                    # support of binary values is not known before the first response
+                    http_client.put_data_into_kvstore('127.0.0.1', port, 'scope', 'key', value)
+                    self.assertIsNone(request.call_args[1].get('headers'))
+                    self.assertTrue(http_client._binary_support[('127.0.0.1', port)])
+                    self.assertEqual(value, http_client.read_data_from_kvstore('127.0.0.1', port, 'scope', 'key'))
+
+                    http_client.put_data_into_kvstore('127.0.0.1', port, 'scope', 'key2', value)
+                    self.assertEqual({'Content-Type': 'application/octet-stream'},
+                                     request.call_args[1].get('headers'))
+
+            # values are stored base64 encoded regardless of how they were sent
+            stored = server.httpd.cache['scope']
+            self.assertEqual(stored['key'], stored['key2'])
+            self.assertEqual(value, codec.loads_base64(stored['key2']))
+        finally:
+            server.shutdown_server()
+
+    def test_loads_base64_from_stream(self):
+        for value in [None, b'', b'a', b'ab', bytes(range(256)) * 100]:
+            encoded = codec.dumps_base64(value, to_ascii=False)
+            for chunk_size in [1, 4, 7, 48, 1024, 48 * 1024]:
+                self.assertEqual(value, codec.loads_base64_from_stream(
+                    io.BytesIO(encoded), len(encoded), chunk_size=chunk_size))
+
+        encoded = codec.dumps_base64(b'value', to_ascii=False)
+        with pytest.raises(EOFError):
+            codec.loads_base64_from_stream(io.BytesIO(encoded[:-4]), len(encoded))
+
+    def test_kvstore_truncated_value(self):
+        # a server that closes the connection before the announced body is sent completely
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(1)
+        port = sock.getsockname()[1]
+
+        def serve():
+            conn, _ = sock.accept()
+            with conn:
+                conn.recv(65536)
+                encoded = codec.dumps_base64('value', to_ascii=False)
+                conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n' % len(encoded) + encoded[:-4])
+
+        server = in_thread(serve)
+        try:
+            with pytest.raises(RuntimeError, match='Read data from KVStore server failed') as e:
+                http_client.read_data_from_kvstore('127.0.0.1', port, 'scope', 'key')
+            self.assertIsInstance(e.value.args[1], EOFError)
+        finally:
+            server.join(5)
+            sock.close()
+
+    def test_kvstore_batch(self):
+        server = KVStoreServer(verbose=0)
+        port = server.start_server()
+        try:
+            values = {str(i): {'rank': i, 'data': bytes(range(256))} for i in range(4)}
+            http_client.put_many_into_kvstore('127.0.0.1', port, 'scope', values)
+            self.assertEqual(values['2'],
+                             http_client.read_data_from_kvstore('127.0.0.1', port, 'scope', '2'))
+
+            http_client.put_data_into_kvstore('127.0.0.1', port, 'scope', '4', None)
+            self.assertEqual({'1': values['1'], '4': None},
+                             http_client.read_many_from_kvstore('127.0.0.1', port, 'scope', ['1', '4']))
+
+            with pytest.raises(RuntimeError):
+                http_client.read_many_from_kvstore('127.0.0.1', port, 'scope', ['1', 'unknown'])
+        finally:
+            server.shutdown_server()
+
     def test_hash(self):
         hash = _hash("test string")
         self.assertEqual(hash, '6f8db599de986fab7a21625b7916589c')
@@ -1042,6 +1369,15 @@ class RunTests(unittest.TestCase):
             hostnames = hosts.parse_host_files(host_filename)
             self.assertEqual(hostnames, '172.31.32.7:8,172.31.33.9:8')
 
+        with temppath() as host_filename:
+            with open(host_filename, 'w+') as fp:
+                fp.write('172.31.32.7 slots=8\n')
+                fp.write('\n')
+                fp.write('172.31.33.9\n')
+
+            with pytest.raises(ValueError, match='Invalid hostfile line'):
+                hosts.parse_host_files(host_filename)
+
     """
     Tests js_run.
     """
@@ -1131,6 +1467,67 @@ rank: 4: { hostname: host2; cpu: {0-3} ; gpu: * ; mem: * }
         _run(hargs)
         mocked_run_controller.assert_called_once()
 
+    @mock.patch('horovod.runner.launch._get_parallel_ssh_client', mock.Mock(return_value=None))
+    def test_check_all_hosts_ssh_successful_retries(self):
+        def execute(output_msg, exit_codes):
+            def fn(command, stdout, stderr):
+                stderr.write(output_msg)
+                return exit_codes.pop(0)
+            return fn
+
+        # retries with exponential backoff until ssh succeeds
+        with mock.patch('horovod.runner.launch.safe_shell_exec.execute',
+                        side_effect=execute('Connection refused', [255, 255, 255, 0])) as exec_mock, \
+                mock.patch('horovod.runner.launch.time.sleep') as sleep:
+            self.assertTrue(_check_all_hosts_ssh_successful(['host'], fn_cache=None))
+            self.assertEqual(4, exec_mock.call_count)
+            self.assertEqual([mock.call(1), mock.call(2), mock.call(4)], sleep.call_args_list)
+
+        # does not retry permanent errors
+        with mock.patch('horovod.runner.launch.safe_shell_exec.execute',
+                        side_effect=execute('Permission denied (publickey)', [255] * 5)) as exec_mock, \
+                mock.patch('horovod.runner.launch.time.sleep') as sleep:
+            self.assertIsNone(_check_all_hosts_ssh_successful(['host'], fn_cache=None))
+            self.assertEqual(1, exec_mock.call_count)
+            sleep.assert_not_called()
+
+        # does not back off beyond the start timeout
+        tmout = timeout.Timeout(3, message='Timed out')
+        with mock.patch('horovod.runner.launch.safe_shell_exec.execute',
+                        side_effect=execute('Connection timed out', [255] * 5)) as exec_mock, \
+                mock.patch('horovod.runner.launch.time.sleep') as sleep:
+            self.assertIsNone(_check_all_hosts_ssh_successful(['host'], None, None, tmout, fn_cache=None))
+            self.assertEqual(3, exec_mock.call_count)
+            self.assertEqual([mock.call(1), mock.call(2)], sleep.call_args_list)
+
+    def test_check_all_hosts_ssh_successful_with_parallel_ssh(self):
+        def host_output(host, exit_code, exception=None):
+            return MagicMock(host=host, exit_code=exit_code, exception=exception)
+
+        client = MagicMock()
+        client.run_command.return_value = [host_output('host-1', 0),
+                                           host_output('host-2', None, Exception('auth failed'))]
+        client_cls = MagicMock(return_value=client)
+
+        # hosts that fail with parallel-ssh are checked with the ssh binary
+        with mock.patch('horovod.runner.launch._get_parallel_ssh_client', return_value=client_cls), \
+                mock.patch('horovod.runner.launch.safe_shell_exec.execute', return_value=0) as exec_mock:
+            self.assertTrue(_check_all_hosts_ssh_successful(['host-1', 'host-2'], 2222, 'key', fn_cache=None))
+            client_cls.assert_called_once_with(['host-1', 'host-2'], num_retries=1, timeout=10,
+                                               pool_size=2, port=2222, pkey='key')
+            self.assertEqual(1, exec_mock.call_count)
+            self.assertIn('host-2', exec_mock.call_args[0][0])
+
+        # the connect timeout does not exceed the start timeout
+        client_cls.reset_mock()
+        tmout = MagicMock()
+        tmout.remaining.return_value = 4.5
+        with mock.patch('horovod.runner.launch._get_parallel_ssh_client', return_value=client_cls), \
+                mock.patch('horovod.runner.launch.safe_shell_exec.execute', return_value=0):
+            self.assertTrue(_check_all_hosts_ssh_successful(['host-1', 'host-2'], None, None, tmout,
+                                                            fn_cache=None))
+            client_cls.assert_called_once_with(['host-1', 'host-2'], num_retries=1, timeout=4.5, pool_size=2)
+
     def test_get_host_assignments(self):
         hosts = parse_hosts('worker-0:2,worker-1:2')
         np = 4
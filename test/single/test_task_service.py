@@ -13,97 +13,138 @@
 # limitations under the License.
 # ==============================================================================
 
-import io
-import re
+import contextlib
+import os
+import tempfile
+import time
 import unittest
 
 from horovod.runner.common.service.task_service import BasicTaskService, BasicTaskClient
 from horovod.runner.common.util import secret
 
+STDOUT_PREFIX = '[0]<stdout>:'
+STDERR_PREFIX = '[0]<stderr>:'
+
+
+def strip_timestamps(text):
+    """Removes everything before the first '[' of each line, which is where the timestamp is."""
+    return ''.join(line[line.find('['):] if '[' in line else line
+                   for line in text.splitlines(keepends=True))
+
+
+class ListStream:
+    """This stream collects written text in a list, which is only joined by getvalue."""
+    def __init__(self):
+        self.texts = []
+
+    def write(self, text):
+        self.texts.append(text)
+
+    def getvalue(self):
+        return ''.join(self.texts)
+
+    def close(self):
+        pass
+
 
 class FaultyStream:
     """This stream raises an exception after some text has been written."""
     def __init__(self, stream):
         self.stream = stream
+        self.written = 0
         self.raised = False
 
     def write(self, b):
-        if not self.raised and len(self.stream.getvalue()) > 1024:
+        if self.written > 1024:
             self.raised = True
+            # this raises only once, all later writes go to the stream directly
+            self.write = self.stream.write
             raise RuntimeError()
         self.stream.write(b)
+        self.written += len(b)
 
     def close(self):
         pass
 
 
 class TaskServiceTest(unittest.TestCase):
+    """
+    Tests are independent of each other and can run in parallel, e.g. with pytest-xdist: pytest -n 4.
+    Every test starts its own service on an ephemeral port and the test output file is unique per process.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # the output of the test command is generated once and only read by the tests,
+        # a few hundred lines are plenty to check the streamed output
+        fd, cls.output_path = tempfile.mkstemp(prefix='test_task_service_', suffix='.log')
+        with os.fdopen(fd, 'w') as output:
+            output.writelines(f'a very very useful log line #{i}\n' for i in range(1, 301))
+
+        cls.cmd = f'cat {cls.output_path}'
+        # the reconnect tests lose the output that is in flight when the stream fails,
+        # they need the output to be produced at the pace of a real command, not all at once
+        cls.cmd_paced = 'for i in {1..10000}; do echo "a very very useful log line #$i"; done'
+        cls.cmd_single_line = f'{cls.cmd} | wc'
+        cls.key = secret.make_secret_key()
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.output_path)
+
+    @contextlib.contextmanager
+    def task_client(self, attempts=1):
+        # a task service executes exactly one command, so every test needs its own service
+        service = BasicTaskService('test service', 0, self.key, nics=None, verbose=2)
+        try:
+            yield BasicTaskClient('test service', service.addresses(), self.key, verbose=2, attempts=attempts)
+        finally:
+            service.shutdown()
 
-    cmd = 'for i in {1..10000}; do echo "a very very useful log line #$i"; done'
-    cmd_single_line = f'{cmd} | wc'
+    def assert_threads_finish(self, threads, timeout=1.0):
+        # join returns as soon as a thread finishes, all threads share one deadline
+        deadline = time.time() + timeout
+        for thread in threads:
+            if thread is not None:
+                thread.join(max(deadline - time.time(), 0))
+                self.assertFalse(thread.is_alive())
 
     @staticmethod
     def cmd_with(stdout, stderr):
         return f"bash -c '{stderr} >&2 & {stdout}'"
 
     def test_run_command(self):
-        key = secret.make_secret_key()
-        service = BasicTaskService('test service', 0, key, nics=None, verbose=2)
-        try:
-            client = BasicTaskClient('test service', service.addresses(), key, verbose=2, attempts=1)
+        with self.task_client() as client:
             client.run_command(self.cmd_with(self.cmd_single_line, self.cmd_single_line), {})
             exit = client.wait_for_command_exit_code()
             self.assertEqual(0, exit)
             self.assertEqual((True, 0), client.command_result())
-        finally:
-            service.shutdown()
 
     def test_stream_command_output(self):
-        self.do_test_stream_command_output(
-            self.cmd_with(self.cmd, self.cmd),
-            capture_stdout=True, capture_stderr=True,
-            prefix_output_with_timestamp=True
-        )
-
-    def test_stream_command_output_stdout(self):
-        self.do_test_stream_command_output(
-            self.cmd_with(self.cmd, self.cmd_single_line),
-            capture_stdout=True, capture_stderr=False,
-            prefix_output_with_timestamp=True
-        )
-
-    def test_stream_command_output_stderr(self):
-        self.do_test_stream_command_output(
-            self.cmd_with(self.cmd_single_line, self.cmd),
-            capture_stdout=False, capture_stderr=True,
-            prefix_output_with_timestamp=True
-        )
-
-    def test_stream_command_output_neither(self):
-        self.do_test_stream_command_output(
-            self.cmd_with(self.cmd_single_line, self.cmd_single_line),
-            capture_stdout=False, capture_stderr=False,
-            prefix_output_with_timestamp=True
-        )
-
-    def test_stream_command_output_un_prefixed(self):
-        self.do_test_stream_command_output(
-            self.cmd_with(self.cmd, self.cmd),
-            capture_stdout=True, capture_stderr=True,
-            prefix_output_with_timestamp=False
-        )
+        # each case needs its own service as a task service executes exactly one command
+        cases = [
+            ('full', self.cmd, self.cmd, True, True, True),
+            ('stdout', self.cmd, self.cmd_single_line, True, False, True),
+            ('stderr', self.cmd_single_line, self.cmd, False, True, True),
+            ('neither', self.cmd_single_line, self.cmd_single_line, False, False, True),
+            ('un_prefixed', self.cmd, self.cmd, True, True, False),
+        ]
+        for name, stdout_cmd, stderr_cmd, capture_stdout, capture_stderr, prefix_output_with_timestamp in cases:
+            with self.subTest(name):
+                self.do_test_stream_command_output(
+                    self.cmd_with(stdout_cmd, stderr_cmd),
+                    capture_stdout=capture_stdout, capture_stderr=capture_stderr,
+                    prefix_output_with_timestamp=prefix_output_with_timestamp
+                )
 
     def do_test_stream_command_output(self,
                                       command,
                                       capture_stdout, capture_stderr,
                                       prefix_output_with_timestamp):
-        stdout = io.StringIO()
-        stderr = io.StringIO()
+        stdout = ListStream()
+        stderr = ListStream()
 
-        key = secret.make_secret_key()
-        service = BasicTaskService('test service', 0, key, nics=None, verbose=2)
-        try:
-            client = BasicTaskClient('test service', service.addresses(), key, verbose=2, attempts=1)
+        with self.task_client() as client:
             stdout_t, stderr_t = client.stream_command_output(stdout, stderr)
             client.run_command(command, {},
                                capture_stdout=capture_stdout, capture_stderr=capture_stderr,
@@ -111,40 +152,16 @@ class TaskServiceTest(unittest.TestCase):
             client.wait_for_command_termination(delay=0.2)
             self.assertEqual((True, 0), client.command_result())
 
-            if stdout_t is not None:
-                stdout_t.join(1.0)
-                self.assertEqual(False, stdout_t.is_alive())
-            if stderr_t is not None:
-                stderr_t.join(1.0)
-                self.assertEqual(False, stderr_t.is_alive())
-        finally:
-            service.shutdown()
+            self.assert_threads_finish([stdout_t, stderr_t])
 
         stdout = stdout.getvalue()
         stderr = stderr.getvalue()
 
-        # remove timestamps from each line in outputs
-        if prefix_output_with_timestamp:
-            stdout_no_ts = re.sub('^[^[]+', '', stdout, flags=re.MULTILINE)
-            stderr_no_ts = re.sub('^[^[]+', '', stderr, flags=re.MULTILINE)
-            # test we are removing something (hopefully timestamps)
-            if capture_stdout:
-                self.assertNotEqual(stdout_no_ts, stdout)
-            if capture_stderr:
-                self.assertNotEqual(stderr_no_ts, stderr)
-            stdout = stdout_no_ts
-            stderr = stderr_no_ts
-
-        # remove prefix
-        stdout_no_prefix = re.sub('\[0\]<stdout>:', '', stdout, flags=re.MULTILINE)
-        stderr_no_prefix = re.sub('\[0\]<stderr>:', '', stderr, flags=re.MULTILINE)
-        # test we are removing something (hopefully prefixes)
+        # remove timestamps and prefixes from captured outputs, there is nothing to remove otherwise
         if capture_stdout:
-            self.assertNotEqual(stdout_no_prefix, stdout)
+            stdout = self.strip_output(stdout, STDOUT_PREFIX, prefix_output_with_timestamp)
         if capture_stderr:
-            self.assertNotEqual(stderr_no_prefix, stderr)
-        stdout = stdout_no_prefix
-        stderr = stderr_no_prefix
+            stderr = self.strip_output(stderr, STDERR_PREFIX, prefix_output_with_timestamp)
 
         if capture_stdout and capture_stderr:
             # both streams should be equal
@@ -158,6 +175,20 @@ class TaskServiceTest(unittest.TestCase):
             self.assertTrue(len(stderr) > 1024)
             self.assertTrue(len(stderr.splitlines()) > 10)
 
+    def strip_output(self, output, prefix, prefix_output_with_timestamp):
+        # remove timestamps from each line in output
+        if prefix_output_with_timestamp:
+            output_no_ts = strip_timestamps(output)
+            # test we are removing something (hopefully timestamps)
+            self.assertNotEqual(output_no_ts, output)
+            output = output_no_ts
+
+        # remove prefix
+        output_no_prefix = output.replace(prefix, '')
+        # test we are removing something (hopefully prefixes)
+        self.assertNotEqual(output_no_prefix, output)
+        return output_no_prefix
+
     def test_stream_command_output_reconnect(self):
         self.do_test_stream_command_output_reconnect(attempts=3, succeeds=True)
 
@@ -165,34 +196,24 @@ class TaskServiceTest(unittest.TestCase):
         self.do_test_stream_command_output_reconnect(attempts=1, succeeds=None)
 
     def do_test_stream_command_output_reconnect(self, attempts, succeeds):
-        key = secret.make_secret_key()
-        stdout = io.StringIO()
-        stderr = io.StringIO()
+        stdout = ListStream()
+        stderr = ListStream()
 
         stdout_s = FaultyStream(stdout)
         stderr_s = FaultyStream(stderr)
-        service = BasicTaskService('test service', 0, key, nics=None, verbose=2)
-        try:
-            client = BasicTaskClient('test service', service.addresses(), key, verbose=2, attempts=attempts)
+        with self.task_client(attempts=attempts) as client:
             stdout_t, stderr_t = client.stream_command_output(stdout_s, stderr_s)
-            client.run_command(self.cmd_with(self.cmd, self.cmd), {},
+            client.run_command(self.cmd_with(self.cmd_paced, self.cmd_paced), {},
                                capture_stdout=True, capture_stderr=True,
                                prefix_output_with_timestamp=False)
             client.wait_for_command_termination(delay=0.2)
             terminated, exit = client.command_result()
-            self.assertEqual(True, terminated)
+            self.assertTrue(terminated)
 
             if succeeds is not None:
                 self.assertEqual(succeeds, exit == 0)
 
-            if stdout_t is not None:
-                stdout_t.join(1.0)
-                self.assertEqual(False, stdout_t.is_alive())
-            if stderr_t is not None:
-                stderr_t.join(1.0)
-                self.assertEqual(False, stderr_t.is_alive())
-        finally:
-            service.shutdown()
+            self.assert_threads_finish([stdout_t, stderr_t])
 
         stdout = stdout.getvalue()
         stderr = stderr.getvalue()
@@ -208,12 +229,14 @@ class TaskServiceTest(unittest.TestCase):
             self.assertTrue(stderr_s.raised)
 
             # assert stdout and stderr similarity (how many lines both have in common)
-            stdout = re.sub('\[0\]<stdout>:', '', stdout, flags=re.MULTILINE)
-            stderr = re.sub('\[0\]<stderr>:', '', stderr, flags=re.MULTILINE)
+            stdout = stdout.replace(STDOUT_PREFIX, '')
+            stderr = stderr.replace(STDERR_PREFIX, '')
+            # the lines of the test command are numbered, so they are distinct
+            # and only one side needs to be turned into a set
             stdout_set = set(stdout.splitlines())
-            stderr_set = set(stderr.splitlines())
-            intersect = stdout_set.intersection(stderr_set)
-            self.assertGreater(len(intersect) / min(len(stdout_set), len(stderr_set)), 0.90)
+            stderr_lines = stderr.splitlines()
+            intersect = stdout_set.intersection(stderr_lines)
+            self.assertGreater(len(intersect) / min(len(stdout_set), len(stderr_lines)), 0.90)
         else:
             # we might have retrieved data only for one of stdout and stderr
             # so we expect some data for at least one of them